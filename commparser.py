@@ -24,8 +24,49 @@
 """
 
 import re
-import json
+import functools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import re2
+    # patterns RE2 does not support fall back to re, don't log them on every load
+    re2_options = re2.Options()
+    re2_options.log_errors = False
+except ImportError:
+    re2 = None
+
+re_bits = re.compile(r"[01]+")
+# anchors, word boundaries and lookarounds, which see different context once patterns are concatenated
+re_zero_width = re.compile(r"[\^$]|\\[bBAZz]|\(\?<?[=!]")
+# all 0xNN spellings of an octet, for the extended community type and subtype
+hex_octets = {
+    f"0x{high}{low}": int(f"{high}{low}", 16)
+    for high in "0123456789abcdefABCDEF"
+    for low in "0123456789abcdefABCDEF"
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_field(pattern: str):
+    """
+    Compile a field pattern from a JSON definition, without its anchors.
+    The patterns come from third party definitions, so prefer the linear time RE2 engine when
+    available and fall back to re for patterns RE2 does not support.
+    """
+    if pattern.startswith("^"):
+        pattern = pattern[1:]
+    if pattern.endswith("$"):
+        pattern = pattern[:-1]
+    if re2:
+        try:
+            return re2.compile(pattern, re2_options)
+        except re2.error:
+            pass
+    return re.compile(pattern)
 
 
 class BGPCommunityParser:
@@ -33,11 +74,29 @@ class BGPCommunityParser:
     An object to keep track of one or more draft-ietf-grow-yang-bgp-communities style BGP community definitions
     and do lookups on them.
     """
-    def __init__(self, sources=None):
+    def __init__(self, sources=None, session=None):
         self.comm_regular = []
         self.comm_large = []
         self.comm_extended = []
         self.sources = []
+        # candidates indexed by integer global admin ASN, or (type, subtype, ASN) for extended communities,
+        # as (matchers, candidate) entries, see _index_entry()
+        self._idx_regular = defaultdict(list)
+        self._idx_large = defaultdict(list)
+        self._idx_extended = defaultdict(list)
+
+        # reuse connections when fetching definitions, optionally shared between parsers
+        # a session passed in is owned by the caller and not closed by close()
+        self._own_session = session is None
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self._session = session
+
+        # the same communities show up on many routes, so cache the lookup results
+        self._parse_cached = functools.lru_cache(maxsize=8192)(self._parse_community)
 
         if not sources:
             return
@@ -45,25 +104,202 @@ class BGPCommunityParser:
         if not isinstance(sources, list):
             sources = [sources]
 
-        for source in sources:
-            self.load_source(source)
+        if len(sources) == 1:
+            self.load_source(sources[0])
+            return
+
+        # fetch multiple sources concurrently, but add them in the given order
+        with ThreadPoolExecutor(max_workers=min(8, len(sources))) as executor:
+            for source, jdata in zip(sources, executor.map(self._fetch_source, sources)):
+                self._add_source(source, jdata)
 
     def load_source(self, source: str):
         """
         Load a draft-yang-bgp-communities style BGP community definition from
         an URL or file.
         """
-        jdata = None
+        self._add_source(source, self._fetch_source(source))
+
+    def _fetch_source(self, source: str) -> dict:
+        """
+        Fetch and decode a BGP community definition from an URL or file.
+        """
         if source.startswith("http://") or source.startswith("https://"):
-            jdata = requests.get(source, timeout=5).json()
-        else:
-            jdata = json.load(source)
+            return orjson.loads(self._session.get(source, timeout=5).content)
+        with open(source, "rb") as fh:
+            return orjson.loads(fh.read())
 
-        self.comm_regular += jdata["draft-ietf-grow-yang-bgp-communities:bgp-communities"]["regular"]
-        self.comm_large += jdata["draft-ietf-grow-yang-bgp-communities:bgp-communities"]["large"]
-        self.comm_extended += jdata["draft-ietf-grow-yang-bgp-communities:bgp-communities"]["extended"]
+    def _add_source(self, source: str, jdata: dict):
+        """
+        Add a decoded BGP community definition to the candidates and indexes.
+        """
+        regular = jdata["draft-ietf-grow-yang-bgp-communities:bgp-communities"]["regular"]
+        large = jdata["draft-ietf-grow-yang-bgp-communities:bgp-communities"]["large"]
+        extended = jdata["draft-ietf-grow-yang-bgp-communities:bgp-communities"]["extended"]
+        self.comm_regular += regular
+        self.comm_large += large
+        self.comm_extended += extended
         self.sources.append(source)
 
+        for candidate in regular:
+            candidate["_prepared"] = [self._prepare_part(candidate["localadmin"], 16)]
+            self._prepare_output(candidate)
+            self._idx_regular[int(candidate["globaladmin"])].append(self._index_entry(candidate))
+        for candidate in large:
+            candidate["_prepared"] = [
+                self._prepare_part(candidate["localdatapart1"], 32),
+                self._prepare_part(candidate["localdatapart2"], 32),
+            ]
+            self._prepare_output(candidate)
+            self._idx_large[int(candidate["globaladmin"])].append(self._index_entry(candidate))
+        for candidate in extended:
+            # the local admin part is 16 bits for 4-byte ASNs and 32 bits for 2-byte ASNs
+            candidate["_prepared"] = [self._prepare_part(candidate["localadmin"], 16 if "asn4" in candidate else 32)]
+            self._prepare_output(candidate)
+            if "asn" in candidate:
+                asn = int(candidate["asn"])
+            elif "asn4" in candidate:
+                asn = int(candidate["asn4"])
+            else:
+                continue
+            self._idx_extended[(candidate["type"], candidate["subtype"], asn)].append(self._index_entry(candidate))
+
+        self._parse_cached.cache_clear()
+
+    def _prepare_part(self, localpart: dict, bits: int) -> dict:
+        """
+        Precompute the format and compiled field patterns of a local admin or local data part
+        """
+        prepared = {
+            "bits": bits if localpart.get("format") == "binary" else None,
+            "fields": [
+                (field.get("length"), _compile_field(field["pattern"]), field["name"], field.get("description"))
+                for field in localpart["fields"]
+            ],
+            "extract": None,
+            "binary": None,
+        }
+        checks = None
+        if prepared["bits"]:
+            checks, prepared["extract"] = self._prepare_binary_checks(prepared["fields"], bits)
+        if checks is None:
+            # matched as (bit) strings
+            prepared["combined"], prepared["spans"] = self._prepare_combined(prepared["fields"])
+            return prepared
+
+        # fold all fixed bit fields into a single mask/value comparison
+        fixed_mask = 0
+        fixed_value = 0
+        pattern_checks = []
+        for shift, mask, value, regex, length in checks:
+            if regex is None:
+                fixed_mask |= mask << shift
+                fixed_value |= value << shift
+            else:
+                pattern_checks.append((shift, mask, regex, length))
+        prepared["binary"] = (bits, fixed_mask, fixed_value, tuple(pattern_checks))
+        return prepared
+
+    def _index_entry(self, candidate: dict) -> tuple:
+        """
+        Build the compact index entry for a candidate: a tuple with a (binary, part) matcher per part,
+        where binary is the flat (bits, fixed mask, fixed value, pattern checks) tuple of binary parts
+        or None, and the candidate itself. The candidate dict is only used once a match is found.
+        """
+        return tuple((part["binary"], part) for part in candidate["_prepared"]), candidate
+
+    def _prepare_output(self, candidate: dict):
+        """
+        Precompute the description output of a candidate. Fields with a static description become
+        (None, "name=description", None) entries, fields showing their value (fid, name, bit length or None).
+        If no field shows its value the whole description is stored in _output.
+        """
+        fid = 0
+        static = True
+        sections = []
+        for part in candidate["_prepared"]:
+            part["output"] = []
+            for index, (_, _, name, description) in enumerate(part["fields"]):
+                if description is not None:
+                    part["output"].append((None, f"{name}={description}", None))
+                else:
+                    # zero length binary fields are shown as an empty string, like other values
+                    length = (part["extract"][index][2] or None) if part["extract"] is not None else None
+                    part["output"].append((fid, name, length))
+                    static = False
+                fid = fid + 1
+            sections.append(",".join(text for _, text, _ in part["output"]))
+        candidate["_output"] = ":".join(sections) if static else None
+
+    def _prepare_combined(self, cfields):
+        """
+        Merge the patterns of fields with a length into a single regex, one group per field,
+        together with the (start, end) span each field should match.
+        Returns (None, []) if the fields can not be merged: fields without a length, patterns with
+        their own groups and patterns with zero width assertions are matched one by one.
+        """
+        if len(cfields) < 2 or any(
+            length is None or regex.groups or re_zero_width.search(regex.pattern) for length, regex, _, _ in cfields
+        ):
+            return None, []
+        try:
+            combined = _compile_field("".join(f"({regex.pattern})" for _, regex, _, _ in cfields))
+        except re.error:
+            return None, []
+
+        spans = []
+        pos = 0
+        for length, _, _, _ in cfields:
+            spans.append((pos, pos + length))
+            pos = pos + length
+        return combined, spans
+
+    def _prepare_binary_checks(self, cfields, bits):
+        """
+        Translate binary fields into (shift, mask, value, regex, length) checks on the integer value.
+        Fixed bit patterns are compared as integers, other patterns are matched against the field bits.
+        Also returns the (shift, mask, length) to extract each field value with: a field without a length
+        is matched against all bits, but shows the bits from its position onwards, which leaves no bits
+        to show for the fields after it.
+        Returns (None, None) if the fields do not fit in the available bits or a zero length field can not match.
+        """
+        checks = []
+        extract = []
+        pos = 0
+        extract_pos = 0
+        for length, regex, _, _ in cfields:
+            if length is None:
+                checks.append((0, (1 << bits) - 1, None, regex, bits))
+                extract.append((0, (1 << (bits - extract_pos)) - 1, bits - extract_pos))
+                extract_pos = bits
+                continue
+            if pos + length > bits:
+                return None, None
+            shift = bits - pos - length
+            if length == 0:
+                # a zero length field is tested against an empty string, so it needs no check,
+                # unless its pattern rejects that and the string based matching can reject the candidate
+                if not regex.fullmatch(""):
+                    return None, None
+            elif len(regex.pattern) == length and re_bits.fullmatch(regex.pattern):
+                checks.append((shift, (1 << length) - 1, int(regex.pattern, 2), None, length))
+            else:
+                checks.append((shift, (1 << length) - 1, None, regex, length))
+            if extract_pos < bits:
+                extract.append((shift, (1 << length) - 1, length))
+                extract_pos = extract_pos + length
+            else:
+                extract.append((0, 0, 0))
+            pos = pos + length
+        return checks, extract
+
+    def close(self):
+        """
+        Release the pooled connections used for fetching definitions, if the session is our own.
+        """
+        if self._own_session:
+            self._session.close()
+
     def __str__(self):
         """
         Simple string representation of the object.
@@ -76,11 +312,18 @@ class BGPCommunityParser:
         """
         Lookup a community string in the loaded community definitions.
         """
-        if re.match(r"^\d+:\d+$", community):
+        return self._parse_cached(community)
+
+    def _parse_community(self, community: str) -> str:
+        """
+        Lookup a community string in the loaded community definitions, bypassing the cache.
+        """
+        colons = community.count(":")
+        if colons == 1:
             return self.parse_regular_community(community)
-        if re.match(r"^\d+:\d+:\d+$", community):
+        if colons == 2:
             return self.parse_large_community(community)
-        if re.match(r"^0x\d\d:0x\d\d:\d+:\d+$", community):
+        if colons == 3 and community.startswith("0x"):
             return self.parse_extended_community(community)
         return None
 
@@ -88,185 +331,139 @@ class BGPCommunityParser:
         """
         Process RFC1997 community
         """
-        asn, content = community.split(":", 1)
-
-        found = self._try_candidates_regular(asn, content, self.comm_regular)
-        if found:
-            fieldvals = self._candidate2fields(content, found["localadmin"])
-            return self._print_match(community, found, fieldvals)
+        parts = community.split(":")
+        if len(parts) != 2 or not (parts[0].isdecimal() and parts[1].isdecimal()):
+            return None
+        asn, content = parts
 
-        return None
+        return self._parse_candidates(community, (content,), self._idx_regular.get(int(asn), ()))
 
     def parse_large_community(self, community: str) -> str:
         """
         Process RFC8092 community
         """
-        asn, content1, content2 = community.split(":", 2)
-
-        found = self._try_candidates_large(asn, content1, content2, self.comm_large)
-        if found:
-            fieldvals = self._candidate2fields_large(
-                content1, content2, found["localdatapart1"], found["localdatapart2"]
-            )
-            return self._print_match(community, found, fieldvals)
+        parts = community.split(":")
+        if len(parts) != 3 or not (parts[0].isdecimal() and parts[1].isdecimal() and parts[2].isdecimal()):
+            return None
+        asn, content1, content2 = parts
 
-        return None
+        return self._parse_candidates(community, (content1, content2), self._idx_large.get(int(asn), ()))
 
     def parse_extended_community(self, community: str) -> str:
         """
         Process RFC4360 community
         """
-        extype, exsubtype, asn, content = community.split(":", 3)
-
-        found = self._try_candidates_extended(
-            extype, exsubtype, asn, content, self.comm_extended
-        )
+        parts = community.split(":")
+        if len(parts) != 4:
+            return None
+        extype, exsubtype, asn, content = parts
+        extype = hex_octets.get(extype)
+        exsubtype = hex_octets.get(exsubtype)
+        if extype is None or exsubtype is None:
+            return None
+        if not (asn.isdecimal() and content.isdecimal()):
+            return None
+
+        return self._parse_candidates(community, (content,), self._idx_extended.get((extype, exsubtype, int(asn)), ()))
+
+    def _parse_candidates(self, community, contents, candidates):
+        """
+        Describe a community using the first matching candidate JSON definition
+        """
+        found, values = self._try_candidates(contents, candidates)
         if found:
-            fieldvals = self._candidate2fields(content, found["localadmin"])
+            if found["_output"] is not None:
+                return found["_output"]
+            fieldvals = self._candidate2fields(values, found)
             return self._print_match(community, found, fieldvals)
 
         return None
 
-    def _try_candidates_regular(self, asn: str, content: str, candidates: list):
-        """
-        Try to find a matching Regular Community amongst candidate JSON definitions
-        """
-        for candidate in candidates:
-            if asn != str(candidate["globaladmin"]):
-                continue
-            if "format" in candidate["localadmin"]:
-                if candidate["localadmin"]["format"] == "binary":
-                    content = self._decimal2bits(content, 16)
-            if self._try_candidate_fields(content, candidate["localadmin"]["fields"]):
-                return candidate
-        return False
-
-    def _try_candidates_large(self, asn, content1, content2, candidates):
+    def _try_candidates(self, contents, candidates):
         """
-        Try to find a matching Large Community amongst candidate JSON definitions
+        Try to find a matching community amongst candidate JSON definitions.
+        Returns the matching candidate and the per part values it was matched against:
+        integers for binary parts, (bit) strings otherwise.
         """
-        for candidate in candidates:
-            if asn != str(candidate["globaladmin"]):
-                continue
-            if "format" in candidate["localdatapart1"]:
-                if candidate["localdatapart1"]["format"] == "binary":
-                    content1 = self._decimal2bits(content1, 32)
-            if "format" in candidate["localdatapart2"]:
-                if candidate["localdatapart2"]["format"] == "binary":
-                    content2 = self._decimal2bits(content2, 32)
-            if self._try_candidate_fields(
-                content1, candidate["localdatapart1"]["fields"]
-            ) and self._try_candidate_fields(
-                content2, candidate["localdatapart2"]["fields"]
-            ):
-                return candidate
-        return False
-
-    def _try_candidates_extended(self, extype, exsubtype, asn, content, candidates):
-        """
-        Try to find a matching Extended Community amongst candidate JSON definitions
-        """
-        for candidate in candidates:
-            contentstring = content
-            if int(extype, 16) != candidate["type"]:
-                continue
-            if int(exsubtype, 16) != candidate["subtype"]:
-                continue
-            if "asn" in candidate:
-                if asn != str(candidate["asn"]):
-                    continue
-            elif "asn4" in candidate:
-                if asn != str(candidate["asn4"]):
+        intvals = [int(content) for content in contents]
+        for matchers, candidate in candidates:
+            values = []
+            for content, intval, (binary, part) in zip(contents, intvals, matchers):
+                if binary is not None:
+                    bits, fixed_mask, fixed_value, pattern_checks = binary
+                    if intval >> bits or intval & fixed_mask != fixed_value:
+                        break
+                    if pattern_checks and not self._try_binary_fields(intval, pattern_checks):
+                        break
+                    values.append(intval)
                     continue
+                if part["bits"]:
+                    content = self._decimal2bits(intval, part["bits"])
+                if not self._try_candidate_fields(content, part):
+                    break
+                values.append(content)
             else:
-                continue
-            if "format" in candidate["localadmin"]:
-                if candidate["localadmin"]["format"] == "binary":
-                    if "asn4" in candidate:
-                        contentstring = self._decimal2bits(content, 16)
-                    else:
-                        contentstring = self._decimal2bits(content, 32)
-            if self._try_candidate_fields(
-                contentstring, candidate["localadmin"]["fields"]
-            ):
-                return candidate
-        return False
-
-    def _try_candidate_fields(self, content, cfields):
+                return candidate, values
+        return None, None
+
+    def _try_candidate_fields(self, content, part):
         """
         Try to match fields from a single candidate JSON definition
         """
-        pos = 0
-        for cfield in cfields:
-            if "length" in cfield:
-                value = content[pos: pos + cfield["length"]]
-            else:
-                value = content
-
-            pattern = cfield["pattern"]
-            if pattern.startswith("^"):
-                pattern = pattern[1:]
-            if pattern.endswith("$"):
-                pattern = pattern[:-1]
-            if not re.match("^{}$".format(pattern), value):
-                # print('{} != {}'.format(pattern,value))
+        if part["combined"]:
+            match = part["combined"].match(content)
+            if not match:
+                # without zero width assertions no split of the content matches all fields,
+                # so the one at the field lengths doesn't either
                 return False
+            size = len(content)
+            for group, (start, end) in enumerate(part["spans"], 1):
+                if match.span(group) != (min(start, size), min(end, size)):
+                    # the regex matched a different split, check the fields one by one
+                    break
+            else:
+                return True
 
-            if "length" in cfield:
-                pos = pos + cfield["length"]
+        pos = 0
+        for length, regex, _, _ in part["fields"]:
+            if length is None:
+                if not regex.fullmatch(content):
+                    return False
+            else:
+                if not regex.fullmatch(content[pos: pos + length]):
+                    return False
+                pos = pos + length
         return True
 
-    def _candidate2fields(self, contentbits, clocaladmin):
+    def _try_binary_fields(self, intval, checks):
         """
-        Link values from tested community to field names in matched candidate
+        Try to match the binary pattern fields from a single candidate JSON definition against an integer value
         """
-        fields = {}
-        pos = 0
-        if "format" in clocaladmin:
-            if clocaladmin["format"] == "binary":
-                contentbits = self._decimal2bits(contentbits, 16)
-        for fid, field in enumerate(clocaladmin["fields"]):
-            if "length" in field:
-                length = field["length"]
-            else:
-                length = len(contentbits)
-            fields[fid] = contentbits[pos: pos + length]
-            pos = pos + length
-        return fields
+        for shift, mask, regex, length in checks:
+            if not regex.fullmatch(f"{(intval >> shift) & mask:0{length}b}"):
+                return False
+        return True
 
-    def _candidate2fields_large(
-        self, contentbits1, contentbits2, clocaldatapart1, clocaldatapart2
-    ):
+    def _candidate2fields(self, values, candidate):
         """
-        Link values from tested large community to field names in matched candidate
+        Link values from tested community to field names in matched candidate.
+        Binary fields are returned as integers, other fields as strings.
         """
         fields = {}
-        if "format" in clocaldatapart1:
-            if clocaldatapart1["format"] == "binary":
-                contentbits1 = self._decimal2bits(contentbits1, 32)
-        if "format" in clocaldatapart2:
-            if clocaldatapart2["format"] == "binary":
-                contentbits2 = self._decimal2bits(contentbits2, 32)
-
-        pos = 0
-        foffset = 0
-        for fid, field in enumerate(clocaldatapart1["fields"]):
-            if "length" in field:
-                length = field["length"]
-            else:
-                length = len(contentbits1)
-            fields[foffset + fid] = contentbits1[pos: pos + length]
-            pos = pos + length
-
-        pos = 0
-        foffset = len(clocaldatapart1["fields"])
-        for fid, field in enumerate(clocaldatapart2["fields"]):
-            if "length" in field:
-                length = field["length"]
-            else:
-                length = len(contentbits2)
-            fields[foffset + fid] = contentbits2[pos: pos + length]
-            pos = pos + length
+        fid = 0
+        for contentbits, part in zip(values, candidate["_prepared"]):
+            if part["extract"] is not None:
+                for shift, mask, length in part["extract"]:
+                    fields[fid] = (contentbits >> shift) & mask if length else ""
+                    fid = fid + 1
+                continue
+            pos = 0
+            for length, _, _, _ in part["fields"]:
+                if length is None:
+                    length = len(contentbits)
+                fields[fid] = contentbits[pos: pos + length]
+                pos = pos + length
+                fid = fid + 1
         return fields
 
     def _decimal2bits(self, decimal, length):
@@ -280,31 +477,15 @@ class BGPCommunityParser:
         Return out a matched community description
         """
         output_sections = []
-        output_fields = []
-        if "localadmin" in candidate:
-            for fid, field in enumerate(candidate["localadmin"]["fields"]):
-                if "description" in field:
-                    output_fields.append(f'{field["name"]}={field["description"]}')
-                else:
-                    output_fields.append(f'{field["name"]}={fieldvals[fid]}')
-            output_sections.append(",".join(output_fields))
-        elif "localdatapart1" in candidate:
-            offset = 0
-            output_fields = []
-            for fid, field in enumerate(candidate["localdatapart1"]["fields"]):
-                if "description" in field:
-                    output_fields.append(f"{field['name']}={field['description']}")
-                else:
-                    output_fields.append(f"{field['name']}={fieldvals[offset + fid]}")
-            output_sections.append(",".join(output_fields))
-
-            offset = len(candidate["localdatapart1"]["fields"])
+        for part in candidate["_prepared"]:
             output_fields = []
-            for fid, field in enumerate(candidate["localdatapart2"]["fields"]):
-                if "description" in field:
-                    output_fields.append(f'{field["name"]}={field["description"]}')
+            for fid, text, length in part["output"]:
+                if fid is None:
+                    output_fields.append(text)
+                elif length:
+                    output_fields.append(f"{text}={fieldvals[fid]:0{length}b}")
                 else:
-                    output_fields.append(f'{field["name"]}={fieldvals[offset + fid]}')
+                    output_fields.append(f"{text}={fieldvals[fid]}")
             output_sections.append(",".join(output_fields))
 
         return f"{':'.join(output_sections)}"
@@ -155,18 +155,17 @@ def read_communities() -> dict:
             try:
                 commlist = yaml.safe_load(fh)
                 sources = commlist.get("sources", {})
-                for asn in sources:
-                    if type(sources[asn]) == str:
-                        sources[asn] = [sources[asn]]
-                    commparser = BGPCommunityParser()
-                    for url in sources[asn]:
-                        commparser.load_source(url)
-                    clist[asn] = {
-                        "obj": commparser,
-                        "regular": {"exact": {}, "re": [], "range": [], "raw": {}},
-                        "large": {"exact": {}, "re": [], "range": [], "raw": {}},
-                        "extended": {"exact": {}, "re": [], "range": [], "raw": {}},
-                    }
+                with requests.Session() as session:
+                    for asn in sources:
+                        if type(sources[asn]) == str:
+                            sources[asn] = [sources[asn]]
+                        commparser = BGPCommunityParser(sources[asn], session=session)
+                        clist[asn] = {
+                            "obj": commparser,
+                            "regular": {"exact": {}, "re": [], "range": [], "raw": {}},
+                            "large": {"exact": {}, "re": [], "range": [], "raw": {}},
+                            "extended": {"exact": {}, "re": [], "range": [], "raw": {}},
+                        }
             except Exception as err:
                 print(f"Failed to parse community URL file: {err}")
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+ Tests for the draft-ietf-grow-yang-bgp-communities parser.
+"""
+
+import os
+import json
+import tempfile
+import unittest
+from commparser import BGPCommunityParser
+
+
+def make_parser(regular=None, large=None, extended=None):
+    """
+    Create a parser from a definition written to a temporary file.
+    """
+    jdata = {
+        "draft-ietf-grow-yang-bgp-communities:bgp-communities": {
+            "regular": regular or [],
+            "large": large or [],
+            "extended": extended or [],
+        }
+    }
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as fh:
+        json.dump(jdata, fh)
+    try:
+        return BGPCommunityParser(fh.name)
+    finally:
+        os.unlink(fh.name)
+
+
+class TestBinaryFields(unittest.TestCase):
+    """
+    Binary format field matching and output.
+    """
+
+    def test_fields_after_field_without_length(self):
+        """
+        A field without a length shows the remaining bits, leaving nothing to show for the fields after it.
+        """
+        parser = make_parser(regular=[{
+            "globaladmin": 65003,
+            "localadmin": {"format": "binary", "fields": [
+                {"name": "a", "length": 4, "pattern": "0001"},
+                {"name": "b", "pattern": "[01]+"},
+                {"name": "c", "length": 4, "pattern": "[01]{4}"},
+            ]},
+        }])
+        self.assertEqual(parser.parse_community("65003:4660"), "a=0001,b=001000110100,c=")
+
+    def test_zero_length_field(self):
+        """
+        A zero length field is matched against an empty string.
+        """
+        parser = make_parser(regular=[
+            {"globaladmin": 65005, "localadmin": {"format": "binary", "fields": [
+                {"name": "a", "length": 16, "pattern": "[01]+"},
+                {"name": "z", "length": 0, "pattern": "^$"},
+            ]}},
+            {"globaladmin": 65006, "localadmin": {"format": "binary", "fields": [
+                {"name": "a", "length": 16, "pattern": "[01]+"},
+                {"name": "z", "length": 0, "pattern": "0"},
+            ]}},
+        ])
+        self.assertEqual(parser.parse_community("65005:5"), "a=0000000000000101,z=")
+        self.assertIsNone(parser.parse_community("65006:5"))
+
+
+if __name__ == "__main__":
+    unittest.main()